@@ -622,8 +622,8 @@ class LocalCoulombMatrix(BaseFeature):
         data = self.convert_input(X)
         dist = cdist(data.coords, data.coords)
 
-        numbers = numpy.array(data.numbers)
-        coords = numpy.array(data.coords)
+        numbers = numpy.asarray(data.numbers)
+        coords = numpy.asarray(data.coords)
 
         vectors = []
         for i in range(len(numbers)):
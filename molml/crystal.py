@@ -10,7 +10,7 @@ import scipy
 
 from .base import BaseFeature, InputTypeMixin
 from .molecule import CoulombMatrix
-from .utils import _radial_iterator
+from .utils import _radial_offsets
 
 
 __all__ = ("GenerallizedCrystal", "EwaldSumMatrix", "SineMatrix")
@@ -206,7 +206,7 @@ class EwaldSumMatrix(CoulombMatrix):
 
         # Short range interactions
         xr = numpy.zeros(ZZ.shape)
-        for L in _radial_iterator(B, self.L_max):
+        for L in _radial_offsets(B, self.L_max):
             # TODO: optimize symmetry
             temp = norm(rr + L, axis=2)
             with numpy.errstate(divide='ignore'):
@@ -216,7 +216,7 @@ class EwaldSumMatrix(CoulombMatrix):
 
         # Long range interactions
         xm = numpy.zeros(ZZ.shape)
-        for G in _radial_iterator(Binv, self.G_max):
+        for G in _radial_offsets(Binv, self.G_max):
             # TODO: optimize symmetry
             temp = norm(G) ** 2
             if not temp:
@@ -5,14 +5,18 @@ from builtins import range
 from collections import Counter
 import importlib
 import json
+import re
 import warnings
-from itertools import product, combinations
+from functools import partial
+from itertools import combinations
+from operator import itemgetter
 
 
 import numpy
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
 from scipy.spatial.distance import cdist
-from scipy.special import expit
-import scipy.stats
+from scipy.special import expit, i0e, ndtr
 
 from .constants import ELE_TO_NUM, TYPE_ORDER, BOND_LENGTHS, UNKNOWN
 
@@ -26,14 +30,37 @@ def multi_beta(f):
     return lambda x, beta: f(beta * x)
 
 
+def norm_pdf(x):
+    return numpy.exp(-0.5 * x ** 2) / numpy.sqrt(2 * numpy.pi)
+
+
+def logistic_pdf(x):
+    # Symmetric, so use -|x| to keep the exponential from overflowing
+    exp = numpy.exp(-numpy.abs(x))
+    return exp / (1 + exp) ** 2
+
+
+def vonmises_pdf(x, kappa):
+    # i0e(k) = exp(-k) * i0(k) keeps this stable for large kappa
+    return numpy.exp(kappa * (numpy.cos(x) - 1)) / (2 * numpy.pi * i0e(kappa))
+
+
+def tanh_smooth(x, beta):
+    # Rescale tanh to [0, 1] in place to avoid extra temporaries
+    res = numpy.tanh(beta * x)
+    res += 1
+    res *= 0.5
+    return res
+
+
 SMOOTHING_FUNCTIONS = {
-    "norm_cdf": multi_beta(scipy.stats.norm.cdf),
+    "norm_cdf": multi_beta(ndtr),
     "zero_one": lambda x, beta: (beta * x > 0.).astype(float),
     "expit": multi_beta(expit),
-    "tanh": lambda x, beta: (numpy.tanh(beta * x) + 1) / 2,
-    "norm": multi_beta(scipy.stats.norm.pdf),
-    "circ": scipy.stats.vonmises.pdf,
-    "expit_pdf": multi_beta(scipy.stats.logistic.pdf),
+    "tanh": tanh_smooth,
+    "norm": multi_beta(norm_pdf),
+    "circ": vonmises_pdf,
+    "expit_pdf": multi_beta(logistic_pdf),
     "spike": lambda x, beta: (numpy.abs(beta * x) < 1.).astype(float),
     "lerp": multi_beta(lerp_smooth),
 }
@@ -87,13 +114,13 @@ def get_bond_type(element1, element2, dist):
         warnings.warn(msg)
         return
 
-    for key in TYPE_ORDER[::-1]:
-        try:
-            cutoff = BOND_LENGTHS[element1][key] + BOND_LENGTHS[element2][key]
-            if dist < cutoff:
-                return key
-        except KeyError:
+    lengths1 = BOND_LENGTHS[element1]
+    lengths2 = BOND_LENGTHS[element2]
+    for key in reversed(TYPE_ORDER):
+        if key not in lengths1 or key not in lengths2:
             continue
+        if dist < lengths1[key] + lengths2[key]:
+            return key
 
 
 def get_connections(elements1, coords1, elements2=None, coords2=None):
@@ -135,27 +162,71 @@ def get_connections(elements1, coords1, elements2=None, coords2=None):
         elements2 = elements1
         coords2 = coords1
 
+    lengths1 = _get_bond_lengths(elements1)
+    if disjoint:
+        lengths2 = _get_bond_lengths(elements2)
+    else:
+        lengths2 = lengths1
+
     dist_mat = cdist(coords1, coords2)
+    # Missing bond lengths are -inf, so those types never match
+    mask = dist_mat < lengths1[:, :, None] + lengths2[:, None, :]
+    bonded = mask.any(axis=0)
+    # Index into TYPE_ORDER of the bond between each pair. Later types take
+    # precedence, matching the order used in get_bond_type.
+    bond_idxs = len(TYPE_ORDER) - 1 - mask[::-1].argmax(axis=0)
+
     connections = {i: {} for i in range(len(elements1))}
-    for i, element1 in enumerate(elements1):
-        for j, element2 in enumerate(elements2):
-            if not disjoint and i >= j:
-                continue
+    idxs = numpy.nonzero(bonded)
+    for i, j, idx in zip(idxs[0].tolist(), idxs[1].tolist(),
+                         bond_idxs[idxs].tolist()):
+        if not disjoint and i >= j:
+            continue
+        bond_type = TYPE_ORDER[idx]
+        connections[i][j] = bond_type
+        if not disjoint:
+            connections[j][i] = bond_type
+    return connections
 
-            dist = dist_mat[i, j]
-            bond_type = get_bond_type(element1, element2, dist)
-            if not bond_type:
-                continue
 
-            connections[i][j] = bond_type
-            if not disjoint:
-                connections[j][i] = bond_type
-    return connections
+# The bond length of each type in TYPE_ORDER for each element
+_BOND_LENGTH_ROWS = {
+    ele: [lengths.get(key, -numpy.inf) for key in TYPE_ORDER]
+    for ele, lengths in BOND_LENGTHS.items()
+}
+_NO_BOND_LENGTHS = [-numpy.inf] * len(TYPE_ORDER)
+
+
+def _get_bond_lengths(elements):
+    """
+    Get the bond lengths of every bond type for all the elements.
+
+    This warns about any elements that are not in BOND_LENGTHS.
+
+    Parameters
+    ----------
+    elements : list
+        All the elements to get bond lengths for.
+
+    Returns
+    -------
+    lengths : numpy.array, shape=(len(TYPE_ORDER), len(elements))
+        The bond length of each element for each bond type. This is -inf if
+        the element does not have a bond length for the bond type.
+    """
+    bad_eles = sorted(x for x in set(elements) if x not in BOND_LENGTHS)
+    if len(bad_eles):
+        msg = "The following elements are not in BOND_LENGTHS: %s" % bad_eles
+        warnings.warn(msg)
+
+    lengths = [_BOND_LENGTH_ROWS.get(x, _NO_BOND_LENGTHS) for x in elements]
+    lengths = numpy.array(lengths, dtype=float)
+    return lengths.reshape(-1, len(TYPE_ORDER)).T
 
 
 def get_graph_distance(connections):
     """
-    Compute the graph distance between all pairs of atoms using Floyd-Warshall
+    Compute the graph distance between all pairs of atoms using BFS
 
     Parameters
     ----------
@@ -167,21 +238,15 @@ def get_graph_distance(connections):
     dist : numpy.array, shape=(len(connections), len(connections))
         The graph distance between all pairs of atoms
     """
-    # Floyd-Warshall
     V = len(connections)
-    dist = numpy.ones((V, V)) * numpy.inf
-    numpy.fill_diagonal(dist, numpy.zeros(V))
+    rows = []
+    cols = []
     for key, values in connections.items():
         for val in values:
-            dist[key, val] = 1
-
-    for k in range(V):
-        for i in range(V):
-            for j in range(V):
-                temp = dist[i, k] + dist[k, j]
-                if dist[i, j] > temp:
-                    dist[i, j] = temp
-    return dist
+            rows.append(key)
+            cols.append(val)
+    graph = csr_matrix((numpy.ones(len(rows)), (rows, cols)), shape=(V, V))
+    return shortest_path(graph, unweighted=True)
 
 
 def get_depth_threshold_mask_connections(connections, min_depth=0,
@@ -209,11 +274,19 @@ def get_depth_threshold_mask_connections(connections, min_depth=0,
     """
     if max_depth < 1:
         max_depth = numpy.inf
-    if not min_depth and max_depth is numpy.inf:
+    if not min_depth and max_depth == numpy.inf:
         V = len(connections)
-        return numpy.ones((V, V)).astype(bool)
+        return numpy.ones((V, V), dtype=bool)
     dist = get_graph_distance(connections)
-    return (min_depth <= dist) & (dist <= max_depth)
+    if max_depth == numpy.inf:
+        if min_depth == numpy.inf:
+            # Only the atoms that are not connected
+            return numpy.isinf(dist)
+        return min_depth <= dist
+    mask = dist <= max_depth
+    if min_depth:
+        mask &= min_depth <= dist
+    return mask
 
 
 class LazyValues(object):
@@ -266,7 +339,11 @@ class LazyValues(object):
     def __init__(self, connections=None, coords=None, numbers=None,
                  elements=None, unit_cell=None):
         self._connections = connections
-        self._coords = self._none_check(coords)
+        if coords is not None:
+            # Store coords once as a contiguous float array so consumers do
+            # not need to convert them again.
+            coords = numpy.ascontiguousarray(coords, dtype=numpy.float64)
+        self._coords = coords
         self._numbers = self._none_check(numbers)
         self._elements = self._none_check(elements)
         self._unit_cell = self._none_check(unit_cell)
@@ -294,18 +371,16 @@ class LazyValues(object):
             If radius and units are either both None, or if both are not None.
         """
         if radius is not None and units is None:
-            offsets = list(_radial_iterator(self.unit_cell, radius))
+            offsets = _radial_offsets(self.unit_cell, radius)
         elif radius is None and units is not None:
-            offsets = list(_unit_iterator(self.unit_cell, units))
+            offsets = _unit_offsets(self.unit_cell, units)
         else:
             raise ValueError("Only one of radius and units must be set.")
-        coords = numpy.array(self.coords)
+        coords = self.coords
         self.__crystal_size = len(offsets)
 
-        new_coords = []
-        for offset in offsets:
-            new_coords.append(coords + offset)
-        self._coords = numpy.concatenate(new_coords)
+        new_coords = offsets[:, None, :] + coords[None, :, :]
+        self._coords = new_coords.reshape(-1, coords.shape[1])
 
         if self._numbers is not None:
             self._numbers = numpy.tile(self._numbers, self.__crystal_size)
@@ -329,9 +404,8 @@ class LazyValues(object):
                 new_conn[key + off] = values
 
         # Connections between cells
-        a = numpy.array(offsets)
         Inv = numpy.linalg.inv(self.unit_cell)
-        counts = Inv.dot(a.T).T
+        counts = Inv.dot(offsets.T).T
         dists = cdist(counts, counts, 'chebyshev')
         for i, j in zip(*numpy.where(dists <= 1)):
             if i == j or i > j:
@@ -426,19 +500,24 @@ def get_coulomb_matrix(numbers, coords, alpha=1, use_decay=False):
     top : array, shape=(n_atoms, n_atoms)
         The coulomb matrix
     """
-    top = numpy.outer(numbers, numbers).astype(numpy.float64)
+    numbers = numpy.asarray(numbers, dtype=numpy.float64)
+    coords = numpy.asarray(coords, dtype=numpy.float64)
+
+    top = numpy.outer(numbers, numbers)
     r = cdist(coords, coords)
     if use_decay:
-        other = cdist([coords[0]], coords).reshape(-1)
-        r += numpy.add.outer(other, other)
+        other = r[0].copy()
+        r += other[:, None]
+        r += other[None, :]
 
-    r **= alpha
+    if alpha != 1:
+        r **= alpha
 
     with numpy.errstate(divide='ignore', invalid='ignore'):
         numpy.divide(top, r, top)
-    numpy.fill_diagonal(top, 0.5 * numpy.array(numbers) ** 2.4)
-    top[top == numpy.Infinity] = 0
-    top[numpy.isnan(top)] = 0
+    # Overlapping atoms give inf/nan, zero them in a single pass
+    top[~numpy.isfinite(top)] = 0
+    numpy.fill_diagonal(top, 0.5 * numbers ** 2.4)
     return top
 
 
@@ -459,16 +538,24 @@ def get_element_pairs(elements):
     # This is like computing set(combinations(sorted(elements), 2))
     # We do this because it scales with elements instead of atoms.
     counts = Counter(elements)
-    pairs = {}
     order = sorted(counts)
+    pairs = []
     for i, x in enumerate(order):
-        for j, y in enumerate(order):
-            if i > j:
-                continue
-            if x == y and counts[x] < 2:
-                continue
-            pairs[x, y] = 1
-    return list(pairs.keys())
+        # Pairs of the same element need at least two of those atoms
+        if counts[x] > 1:
+            pairs.append((x, x))
+        for y in order[i + 1:]:
+            pairs.append((x, y))
+    return pairs
+
+
+# Matches each `__arg=value` pair of a slug string
+_SLUG_PARAM_RE = re.compile(r'__((?:(?!__)[^=])+)=((?:(?!__)[^=])*)')
+_SLUG_SWAP = {
+    'None': None,
+    'True': True,
+    'False': False,
+}
 
 
 def deslugify(string):
@@ -487,28 +574,34 @@ def deslugify(string):
 
         final_params : dict
             A dictionary of the feature parameters.
+
+    Raises
+    ------
+    ValueError
+        If any of the parameters are not of the form `arg=value`.
     """
-    parts = string.split('__')
-    name = parts[0]
-    params = parts[1:]
-    swap = {
-        'None': None,
-        'True': True,
-        'False': False,
-    }
+    name = string.split('__', 1)[0]
+    params = string[len(name):]
     final_params = dict()
-    for param in params:
-        arg, value = param.split('=')
-        try:
-            value = int(value)
-        except ValueError:
+    end = 0
+    for match in _SLUG_PARAM_RE.finditer(params):
+        if match.start() != end:
+            break
+        end = match.end()
+        arg, value = match.groups()
+        if value in _SLUG_SWAP:
+            value = _SLUG_SWAP[value]
+        else:
             try:
-                value = float(value)
+                value = int(value)
             except ValueError:
-                pass
-        if value in swap:
-            value = swap[value]
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
         final_params[arg] = value
+    if end != len(params):
+        raise ValueError("Invalid slug parameters: '%s'" % params[end:])
     return name, final_params
 
 
@@ -545,6 +638,14 @@ def cosine_decay(R, r_cut=6.):
     return values
 
 
+def _select_none(value):
+    return tuple()
+
+
+def _select_one(idx, value):
+    return (value[idx], )
+
+
 class IndexMap(object):
     '''
     An object to handle dynamic mapping of groups to indices.
@@ -589,9 +690,20 @@ class IndexMap(object):
             self.idx_groups = list(combinations(idx_values, self.depth))
         else:
             self.idx_groups = IndexMap._get_form_indices(length, depth)
+        self._set_getters()
         self._mapping = IndexMap.get_index_mapping(values, depth,
                                                    self.idx_groups)
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Maps pickled by older versions do not have the getters
+        if '_getters' not in state:
+            self._set_getters()
+
+    def _set_getters(self):
+        self._getters = [IndexMap._get_tuple_getter(idxs)
+                         for idxs in self.idx_groups]
+
     def is_valid(self, values):
         return self.values == values
 
@@ -603,10 +715,10 @@ class IndexMap(object):
             yield x
 
     def __getitem__(self, key):
-        return self._inner(key, self.idx_groups[0])
+        return self._inner(key, self._getters[0])
 
-    def _inner(self, key, idxs):
-        key = sort_chain(tuple(key[i] for i in idxs))
+    def _inner(self, key, getter):
+        key = sort_chain(getter(key))
         if key not in self._mapping and self.add_unknown:
             return -1
         return self._mapping[key]
@@ -614,9 +726,9 @@ class IndexMap(object):
     def get_idx_iter(self, key, other=None):
         if other is None:
             other = tuple()
-        for idxs in self.idx_groups:
+        for getter in self._getters:
             try:
-                yield other + (self._inner(key, idxs), )
+                yield other + (self._inner(key, getter), )
             except KeyError:
                 yield None
 
@@ -679,6 +791,28 @@ class IndexMap(object):
             final.append(tuple(i + 1 for i in res))
         return final
 
+    @staticmethod
+    def _get_tuple_getter(idxs):
+        """
+        Get a function that selects the given indices from a value as a tuple.
+
+        Parameters
+        ----------
+        idxs : tuple of ints
+            The indices to select.
+
+        Returns
+        -------
+        getter : callable
+            A function that maps a value to the tuple of selected elements.
+        """
+        # These are all picklable so fitted transformers can be saved
+        if not idxs:
+            return _select_none
+        if len(idxs) == 1:
+            return partial(_select_one, idxs[0])
+        return itemgetter(*idxs)
+
     @staticmethod
     def get_index_mapping(values, depth, idx_groups):
         """
@@ -703,9 +837,8 @@ class IndexMap(object):
         if depth < 1:
             # Just a constant value
             return {tuple(): 0}
-        temp_values = [[tuple(x[i] for i in idxs) for x in values]
-                       for idxs in idx_groups]
-        new_values = set(sort_chain(x) for x in sum(temp_values, []))
+        new_values = set(sort_chain(tuple(x[i] for i in idxs))
+                         for idxs in idx_groups for x in values)
         mapping = {key: i for i, key in enumerate(sorted(new_values))}
         return mapping
 
@@ -726,26 +859,16 @@ def needs_reversal(chain):
     needs_flip : bool
         Whether or not the chain needs to be reversed
     """
-    x = len(chain)
-    if x == 1:
-        first = 0
-        second = 0
-    else:
-        q, r = divmod(x, 2)
-        first = q - 1
-        second = q + r
-
-    while first >= 0 and second < len(chain):
+    # Walk outward from the center, the first unequal pair decides the order
+    first = len(chain) // 2 - 1
+    second = len(chain) - 1 - first
+    while first >= 0:
         if chain[first] > chain[second]:
-            # Case where order reversal is needed
             return True
-        elif chain[first] == chain[second]:
-            # Indeterminate case
-            first -= 1
-            second += 1
-        else:
-            # Case already in the correct order
+        elif chain[first] != chain[second]:
             return False
+        first -= 1
+        second += 1
     return False
 
 
@@ -794,21 +917,24 @@ def get_angles(coords):
     return res
 
 
-def _load_transformer(data):
+_TRANSFORMER_KEYS = frozenset(["attributes", "parameters", "transformer"])
+
+
+def _get_transformer_class(path):
     """
-    Load the transformer object
+    Get the transformer class from its full import path
 
     Parameters
     ----------
-    data : dict
-        A dictionary of values to load as a transformer.
+    path : str
+        The dotted path to the class (ex: 'molml.molecule.Connectivity').
 
     Returns
     -------
-    obj : Transformer
-        The transformer object.
+    cls : type
+        The transformer class.
     """
-    module, klass = data["transformer"].rsplit('.', 1)
+    module, klass = path.rsplit('.', 1)
 
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
@@ -816,12 +942,28 @@ def _load_transformer(data):
         # https://github.com/uqfoundation/dill/issues/210
         m = importlib.import_module(module)
 
-    cls = getattr(m, klass)
-    comp = set(["attributes", "parameters", "transformer"])
+    return getattr(m, klass)
+
+
+def _load_transformer(data):
+    """
+    Load the transformer object
+
+    Parameters
+    ----------
+    data : dict
+        A dictionary of values to load as a transformer.
+
+    Returns
+    -------
+    obj : Transformer
+        The transformer object.
+    """
+    cls = _get_transformer_class(data["transformer"])
     parameters = {}
     for key, value in data["parameters"].items():
         if not isinstance(value, dict) or \
-           len(comp & set(value.keys())) != 3:
+           not _TRANSFORMER_KEYS.issubset(value):
             parameters[key] = value
             continue
         parameters[key] = _load_transformer(value)
@@ -854,23 +996,41 @@ def load_json(f):
     return _load_transformer(data)
 
 
-def _radial_iterator(X, r_max):
+def _lattice_offsets(X, ranges):
+    """
+    Compute the offsets of all the lattice points in the given ranges.
+
+    Parameters
+    ----------
+    X : array, shape=(3, 3)
+        An array of unit cell basis vectors, where the vectors are columns.
+
+    ranges : list of ranges
+        The integer steps to take along each of the basis vectors.
+
+    Returns
+    -------
+    offsets : array, shape=(n_points, 3)
+        The cartesian offset of each lattice point, ordered like
+        itertools.product(*ranges).
+    """
+    grid = numpy.meshgrid(*ranges, indexing='ij')
+    groups = numpy.array([x.reshape(-1) for x in grid]).T
+    return groups.dot(X.T)
+
+
+def _radial_offsets(X, r_max):
     X = numpy.array(X)
-    norm = numpy.linalg.norm
-    lengths = norm(X, axis=0)
+    lengths = numpy.linalg.norm(X, axis=0)
     # Compute the upper bounds for each axis
     steps = numpy.ceil(r_max / lengths).astype(int)
     ranges = [range(-x, x + 1) for x in steps]
 
-    for group in product(*ranges):
-        group = numpy.array(group)
-        temp_z = numpy.dot(X, group)
-        if norm(temp_z) > r_max:
-            continue
-        yield temp_z
+    offsets = _lattice_offsets(X, ranges)
+    return offsets[numpy.linalg.norm(offsets, axis=1) <= r_max]
 
 
-def _unit_iterator(X, unit_max):
+def _unit_offsets(X, unit_max):
     X = numpy.array(X)
     if isinstance(unit_max, int):
         ranges = [range(-unit_max, unit_max + 1) for _ in range(3)]
@@ -879,8 +1039,4 @@ def _unit_iterator(X, unit_max):
         if len(unit_max) != X.shape[1]:
             raise ValueError("Invalid unit cell size.")
         ranges = [range(-x, x + 1) for x in unit_max]
-
-    for group in product(*ranges):
-        group = numpy.array(group)
-        temp_z = numpy.dot(X, group)
-        yield temp_z
+    return _lattice_offsets(X, ranges)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from molml.io import read_file_data
 
@@ -34,3 +35,15 @@ MID_COORDS = MID_VALS.coords
 MID = (MID_ELEMENTS, MID_COORDS)
 
 ALL_DATA = [METHANE, MID, BIG]
+
+
+class TempPathMixin(object):
+    """
+    A TestCase mixin to get temporary file paths.
+    """
+    def _get_temp_path(self):
+        # Use a unique file so tests can run in parallel processes
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        return path
@@ -13,6 +13,7 @@ from molml.base import EncodedFeature, FormMixin
 
 from .constants import METHANE_ELEMENTS, METHANE_COORDS, METHANE_PATH
 from .constants import METHANE, METHANE_NUMBERS, METHANE_CONNECTIONS
+from .constants import TempPathMixin
 
 
 METHANE_ATOMS = numpy.array([[1, 4]])
@@ -136,7 +137,7 @@ class OtherTest(unittest.TestCase):
         self.assertEqual(res, 5)
 
 
-class BaseFeatureTest(unittest.TestCase):
+class BaseFeatureTest(TempPathMixin, unittest.TestCase):
 
     def test_map_n_jobs_negative(self):
         a = BaseFeature(n_jobs=-1)
@@ -318,7 +319,7 @@ class BaseFeatureTest(unittest.TestCase):
                     'transformer': base + '.TestFeature1'}
         self.assertEqual(data, expected)
 
-        path = '/tmp/somefile.json'
+        path = self._get_temp_path()
         a.save_json(path)
         with open(path, 'r') as f:
             data = json.load(f)
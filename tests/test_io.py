@@ -9,6 +9,7 @@ from molml.io import read_cry_data
 
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), "data")
+BASE_PATH = os.path.join(DATA_PATH, "methane")
 ELEMENTS = ['C', 'H', 'H', 'H', 'H']
 NUMBERS = [6, 1, 1, 1, 1]
 COORDS = [
@@ -27,18 +28,22 @@ UNIT = [
 
 class IOTest(unittest.TestCase):
 
-    def test_read_file_data(self):
-        base_path = os.path.join(DATA_PATH, "methane")
+    @classmethod
+    def setUpClass(cls):
+        # Parse each file once with its specific reader
         data = (
                 ('.out', read_out_data),
                 ('.xyz', read_xyz_data),
                 ('.mol2', read_mol2_data),
                 ('.cry', read_cry_data),
         )
+        cls._values = {}
         for ending, func in data:
-            path = base_path + ending
-            v1 = func(path)
-            v2 = read_file_data(path)
+            cls._values[ending] = func(BASE_PATH + ending)
+
+    def test_read_file_data(self):
+        for ending, v1 in self._values.items():
+            v2 = read_file_data(BASE_PATH + ending)
             self.assertEqual(v1.elements.tolist(), v2.elements.tolist())
             self.assertEqual(v1.numbers.tolist(), v2.numbers.tolist())
             self.assertTrue(numpy.allclose(v1.coords, v2.coords))
@@ -58,8 +63,7 @@ class IOTest(unittest.TestCase):
         read_mol2_data(path)
 
     def test_read_cry_data_unit(self):
-        path = os.path.join(DATA_PATH, "methane.cry")
-        v = read_cry_data(path)
+        v = self._values['.cry']
         try:
             numpy.testing.assert_array_almost_equal(
                 v.unit_cell,
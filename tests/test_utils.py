@@ -1,6 +1,7 @@
 import unittest
 import os
 import json
+import pickle
 import warnings
 
 import numpy
@@ -16,6 +17,8 @@ from molml.utils import sort_chain, needs_reversal
 from molml.utils import load_json, IndexMap
 from molml.constants import UNKNOWN
 
+from .constants import TempPathMixin
+
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), "data")
 ELEMENTS = ['C', 'H', 'H', 'H', 'H']
@@ -39,9 +42,19 @@ UNIT_CELL = [
     [0., 1., 0.],
     [0., 0., 1.]
 ]
+COULOMB_MATRIX = numpy.array([
+    [0.5, 1.0],
+    [1.0, 0.5]])
+COULOMB_MATRIX_ALPHA = numpy.array([
+    [0.5, 4.],
+    [4., 0.5]])
+COULOMB_MATRIX_DECAY = numpy.array([
+    [0.5, 1., 1.],
+    [1., 0.5, 0.585786],
+    [1., 0.585786, 0.5]])
 
 
-class UtilsTest(unittest.TestCase):
+class UtilsTest(TempPathMixin, unittest.TestCase):
 
     def test_smoothing_functions(self):
         # These are mostly sanity checks for the functions
@@ -74,6 +87,18 @@ class UtilsTest(unittest.TestCase):
             except AssertionError as e:
                 self.fail(e)
 
+    def test_smoothing_zero_one(self):
+        f = get_smoothing_function('zero_one')
+        values = numpy.array([-1., -0.5, 0., 0.5, 1.])
+        expected = numpy.array([0., 0., 0., 1., 1.])
+        self.assertTrue(numpy.array_equal(f(values, 1.), expected))
+
+    def test_smoothing_spike(self):
+        f = get_smoothing_function('spike')
+        values = numpy.array([-1., -0.5, 0., 0.5, 1.])
+        expected = numpy.array([0., 1., 1., 1., 0.])
+        self.assertTrue(numpy.array_equal(f(values, 1.), expected))
+
     def test_smoothing_lerp(self):
         f = get_smoothing_function('lerp')
         # Note: this is slightly different from the others because lerp
@@ -112,44 +137,22 @@ class UtilsTest(unittest.TestCase):
 
     def test_get_coulomb_matrix(self):
         res = get_coulomb_matrix([1, 1], [[0.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
-        expected_results = numpy.array([
-            [0.5, 1.0],
-            [1.0, 0.5]])
-        try:
-            numpy.testing.assert_array_almost_equal(
-                res,
-                expected_results)
-        except AssertionError as e:
-            self.fail(e)
+        self.assertTrue(numpy.allclose(res, COULOMB_MATRIX, rtol=0,
+                                       atol=1e-6))
 
     def test_get_coulomb_matrix_alpha(self):
         nums = [1, 1]
         coords = [[0.0, 0.0, 0.0], [0.0, 0.0, .5]]
         res = get_coulomb_matrix(nums, coords, alpha=2)
-        expected_results = numpy.array([
-            [0.5, 4.],
-            [4., 0.5]])
-        try:
-            numpy.testing.assert_array_almost_equal(
-                res,
-                expected_results)
-        except AssertionError as e:
-            self.fail(e)
+        self.assertTrue(numpy.allclose(res, COULOMB_MATRIX_ALPHA, rtol=0,
+                                       atol=1e-6))
 
     def test_get_coulomb_matrix_use_decay(self):
         nums = [1, 1, 1]
         coords = [[0.0, 0.0, 0.0], [0.0, 0.0, .5], [0.0, 0.5, 0.0]]
         res = get_coulomb_matrix(nums, coords, use_decay=True)
-        expected_results = numpy.array([
-            [0.5, 1., 1.],
-            [1., 0.5, 0.585786],
-            [1., 0.585786, 0.5]])
-        try:
-            numpy.testing.assert_array_almost_equal(
-                res,
-                expected_results)
-        except AssertionError as e:
-            self.fail(e)
+        self.assertTrue(numpy.allclose(res, COULOMB_MATRIX_DECAY, rtol=0,
+                                       atol=1e-6))
 
     def test_get_element_pairs(self):
         res = get_element_pairs(ELEMENTS)
@@ -164,6 +167,19 @@ class UtilsTest(unittest.TestCase):
         expected = ('ClassM', {'none': None, 'true': True, 'false': False})
         self.assertEqual(deslugify(string), expected)
 
+    def test_deslugify_underscores(self):
+        string = 'Class__use_it=True__smooth=norm_cdf__neg=-2__exp=1e-3'
+        expected = ('Class', {'use_it': True, 'smooth': 'norm_cdf',
+                              'neg': -2, 'exp': 1e-3})
+        self.assertEqual(deslugify(string), expected)
+
+        self.assertEqual(deslugify('Class'), ('Class', {}))
+
+    def test_deslugify_invalid(self):
+        for string in ('Class__foo__bar=1', 'A__a=b=c', 'A__', 'A__a=1__'):
+            with self.assertRaises(ValueError):
+                deslugify(string)
+
     def test_sort_chain(self):
         needs_flip = ("O", "H", "C")
         expected = ("C", "H", "O")
@@ -173,6 +189,9 @@ class UtilsTest(unittest.TestCase):
         expected = ("C", "H", "H", "O")
         self.assertEqual(sort_chain(needs_flip), expected)
 
+        needs_flip = numpy.array(["O", "H", "C"])
+        self.assertEqual(sort_chain(needs_flip).tolist(), ["C", "H", "O"])
+
     def test_needs_reversal(self):
         needs_flip = ("O", "H", "C")
         self.assertTrue(needs_reversal(needs_flip))
@@ -186,12 +205,24 @@ class UtilsTest(unittest.TestCase):
         no_flip = ("O", "C", "H", "O")
         self.assertFalse(needs_reversal(no_flip))
 
+        # The order is decided from the center out, not from the ends in
+        no_flip = ("O", "C", "H", "C")
+        self.assertFalse(needs_reversal(no_flip))
+
+        # Labels are compared as strings, not by atomic number
+        needs_flip = ("H", "H", "C")
+        self.assertTrue(needs_reversal(needs_flip))
+
+        needs_flip = numpy.array(["O", "H", "C", "N"])
+        self.assertIs(needs_reversal(needs_flip), True)
+        self.assertIs(needs_reversal(list(needs_flip)), True)
+
     def test_load_json(self):
         data = {'parameters': {'n_jobs': 2,
                                'input_type': 'list'},
                 'attributes': {'_base_chains': [['H']]},
                 'transformer': 'molml.molecule.Connectivity'}
-        path = '/tmp/somefile.json'
+        path = self._get_temp_path()
         with open(path, 'w') as f:
             json.dump(data, f)
 
@@ -219,7 +250,7 @@ class UtilsTest(unittest.TestCase):
             'attributes': {'_base_chains': [['H']]},
             'transformer': 'molml.molecule.Connectivity'
         }
-        path = '/tmp/somefile.json'
+        path = self._get_temp_path()
         with open(path, 'w') as f:
             json.dump(data, f)
 
@@ -317,6 +348,20 @@ class UtilsTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_get_depth_threshold_mask_connections_disjoint_max(self):
+        conn = {
+            0: {1: '1'},
+            1: {0: '1'},
+            2: {3: '1'},
+            3: {2: '1'},
+        }
+        res = get_depth_threshold_mask_connections(conn, min_depth=numpy.inf,
+                                                   max_depth=3)
+        try:
+            numpy.testing.assert_equal(res, numpy.zeros((4, 4), dtype=bool))
+        except AssertionError as e:
+            self.fail(e)
+
     def test_get_depth_threshold_mask_connections_max(self):
         conn = {
             0: {1: '1'},
@@ -389,6 +434,12 @@ class LazyValuesTest(unittest.TestCase):
         self.assertEqual(a.connections, CONNECTIONS)
         self.assertEqual(a.unit_cell.tolist(), UNIT_CELL)
 
+    def test_coords_array(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS)
+        self.assertEqual(a.coords.dtype, numpy.float64)
+        self.assertTrue(a.coords.flags['C_CONTIGUOUS'])
+        self.assertTrue(numpy.array_equal(a.coords, COORDS))
+
     def test_num_from_ele(self):
         a = LazyValues(elements=ELEMENTS)
         self.assertEqual(a.numbers.tolist(), NUMBERS)
@@ -557,6 +608,40 @@ class IndexMapTest(unittest.TestCase):
         self.assertEqual(a.get_value_order(),
                          [('C', ), ('H', ), (UNKNOWN, )])
 
+    def test_get_tuple_getter(self):
+        value = ('A', 'B', 'C')
+        expected = (
+            (tuple(), tuple()),
+            ((1, ), ('B', )),
+            ((0, 2), ('A', 'C')),
+        )
+        for idxs, expected_value in expected:
+            getter = IndexMap._get_tuple_getter(idxs)
+            self.assertEqual(getter(value), expected_value)
+
+    def test_pickle(self):
+        values = [('C', 'H', 'O'), ('H', 'H', 'O'), ('C', 'C', 'H')]
+        for depth in (0, 1, 2):
+            a = IndexMap(values, depth, add_unknown=True)
+            b = pickle.loads(pickle.dumps(a))
+            self.assertEqual(b.get_value_order(), a.get_value_order())
+            for value in values + [('N', 'N', 'N')]:
+                self.assertEqual(list(b.get_idx_iter(value)),
+                                 list(a.get_idx_iter(value)))
+
+    def test_unpickle_without_getters(self):
+        values = [('C', 'H', 'O'), ('H', 'H', 'O'), ('C', 'C', 'H')]
+        for depth in (0, 1, 2):
+            a = IndexMap(values, depth, add_unknown=True)
+            state = a.__dict__.copy()
+            del state['_getters']
+            b = IndexMap.__new__(IndexMap)
+            b.__setstate__(state)
+            self.assertEqual(b[values[0]], a[values[0]])
+            for value in values + [('N', 'N', 'N')]:
+                self.assertEqual(list(b.get_idx_iter(value)),
+                                 list(a.get_idx_iter(value)))
+
     def test__get_form_indices(self):
         data = (
             (  # 1